@@ -1,91 +1,323 @@
 """Cache layer supporting both in-memory and Redis"""
-from typing import Optional, Dict
-from datetime import datetime, timedelta
-import json
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional, Dict, List, Tuple, Union
+import functools
+import logging
+import threading
+import time
 
-from app.models import Flag
+import orjson
+
+from app.models import Flag, FlagType
 from app.config import settings
 
 # Try to import Redis, fall back to in-memory if not available
 try:
-    import redis
+    from redis.asyncio import Redis as AsyncRedis
+    from redis.exceptions import RedisError
     REDIS_AVAILABLE = True
 except ImportError:
     REDIS_AVAILABLE = False
 
+logger = logging.getLogger(__name__)
+
+# Prefix on every Redis payload; bump it when the encoding changes so
+# entries written by older code are ignored instead of misread
+CACHE_FORMAT_VERSION = "1"
+
+# Number of keys fetched per SCAN call and deleted per UNLINK
+SCAN_BATCH_SIZE = 500
+
+# Number of independently locked partitions in the in-memory cache
+CACHE_SHARDS = 16
+
+# key -> (flag or MISS, monotonic expiry), plus the lock guarding it
+Shard = Tuple["OrderedDict[str, Tuple[Union[Flag, object], float]]", threading.Lock]
+
+# Returned by get() for keys recently looked up and found not to exist
+MISS = object()
+
+# Longest time a key is remembered as missing
+NEGATIVE_CACHE_TTL = 5
+
+# Redis payload stored for a missing key
+MISS_PAYLOAD = "__MISS__"
+
+# Consecutive Redis failures before the cache is bypassed, and for how long
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN = 5.0
+
+
+def _fail_open(default: Callable[[], object] = lambda: None):
+    """Treat Redis errors as cache misses, skipping Redis while the circuit is open"""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if time.monotonic() < self._open_until:
+                return default()
+            try:
+                result = await method(self, *args, **kwargs)
+            except RedisError as e:
+                self._record_failure(e)
+                return default()
+            self._failures = 0
+            return result
+        return wrapper
+    return decorator
+
+
+class CacheUnavailableError(Exception):
+    """Raised when a cache entry could not be invalidated"""
+
+
+def _always_try(method):
+    """Run an invalidation against Redis even while the circuit is open"""
+    # Skipping or swallowing a failed delete would leave stale flags in
+    # Redis for up to the TTL, so the caller has to know about it
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            result = await method(self, *args, **kwargs)
+        except RedisError as e:
+            self._record_failure(e)
+            raise CacheUnavailableError(str(e)) from e
+        self._failures = 0
+        return result
+    return wrapper
+
+
+def _parse_datetime(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp, including pydantic's "Z" UTC suffix"""
+    # The backend supports Python 3.9+ (see README), but datetime.fromisoformat
+    # only understands "Z" from 3.11; drop this once 3.11 is the minimum
+    if value.endswith("Z"):
+        value = f"{value[:-1]}+00:00"
+    return datetime.fromisoformat(value)
+
 
 class InMemoryCache:
-    """Simple in-memory cache with TTL (fallback)"""
+    """Simple in-memory LRU cache with TTL (fallback)"""
     
-    def __init__(self, ttl_seconds: int = 30):
-        self._cache: Dict[str, tuple[Flag, datetime]] = {}
-        self._ttl = timedelta(seconds=ttl_seconds)
+    def __init__(self, ttl_seconds: int = 30, max_size: int = 10000, shards: int = CACHE_SHARDS):
+        # Keys are spread over independently locked shards so concurrent
+        # threads rarely contend; each shard is ordered least to most recently used
+        self._shards: List[Shard] = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+        self._ttl = ttl_seconds
+        self._shard_max_size = max(1, (max_size + shards - 1) // shards)
     
-    def get(self, key: str) -> Optional[Flag]:
-        """Get flag from cache if not expired"""
-        if key not in self._cache:
-            return None
-        
-        flag, timestamp = self._cache[key]
-        
-        # Check if expired
-        if datetime.utcnow() - timestamp > self._ttl:
-            del self._cache[key]
-            return None
-        
-        return flag
+    def _shard(self, key: str) -> Shard:
+        """Pick the shard responsible for a key"""
+        return self._shards[hash(key) % len(self._shards)]
+    
+    async def get(self, key: str) -> Union[Flag, object, None]:
+        """Get flag from cache if not expired, or MISS for a known missing key"""
+        entries, lock = self._shard(key)
+        with lock:
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            
+            flag, expires_at = entry
+            
+            # Check if expired
+            if expires_at < time.monotonic():
+                del entries[key]
+                return None
+            
+            entries.move_to_end(key)
+            return flag
+    
+    async def get_many(self, keys: List[str]) -> Dict[str, Flag]:
+        """Get all cached, non-expired flags for the given keys"""
+        found = {}
+        for key in keys:
+            flag = await self.get(key)
+            if flag and flag is not MISS:
+                found[key] = flag
+        return found
+    
+    async def set(self, key: str, flag: Flag) -> None:
+        """Store flag in cache"""
+        self._store(key, flag, self._ttl)
+    
+    async def set_miss(self, key: str) -> None:
+        """Remember briefly that no flag exists for this key"""
+        self._store(key, MISS, min(self._ttl, NEGATIVE_CACHE_TTL))
     
-    def set(self, key: str, flag: Flag) -> None:
-        """Store flag in cache with current timestamp"""
-        self._cache[key] = (flag, datetime.utcnow())
+    def _store(self, key: str, value: object, ttl: float) -> None:
+        """Store an entry, evicting the least recently used on overflow"""
+        entries, lock = self._shard(key)
+        with lock:
+            entries[key] = (value, time.monotonic() + ttl)
+            entries.move_to_end(key)
+            if len(entries) > self._shard_max_size:
+                entries.popitem(last=False)
     
-    def delete(self, key: str) -> None:
+    async def set_many(self, flags: List[Flag]) -> None:
+        """Store several flags in cache, keyed by flag key"""
+        for flag in flags:
+            await self.set(flag.key, flag)
+    
+    async def delete(self, key: str) -> None:
         """Remove flag from cache"""
-        self._cache.pop(key, None)
+        entries, lock = self._shard(key)
+        with lock:
+            entries.pop(key, None)
     
-    def clear(self) -> None:
+    async def clear(self) -> None:
         """Clear entire cache"""
-        self._cache.clear()
+        for entries, lock in self._shards:
+            with lock:
+                entries.clear()
+    
+    async def close(self) -> None:
+        """Release cache resources (nothing to do in memory)"""
 
 
 class RedisCache:
     """Redis-backed distributed cache"""
     
-    def __init__(self, redis_url: str, ttl_seconds: int = 30):
-        self._redis = redis.from_url(redis_url, decode_responses=True)
+    def __init__(
+        self,
+        redis_url: str,
+        ttl_seconds: int = 30,
+        max_connections: int = 50,
+        socket_timeout: float = 0.05,
+        connect_timeout: float = 0.1,
+    ):
+        # Async client so cache round-trips never block the event loop.
+        # Short timeouts keep a stalled Redis from hanging requests; callers
+        # fall back to the database instead.
+        self._redis = AsyncRedis.from_url(
+            redis_url,
+            decode_responses=True,
+            max_connections=max_connections,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=connect_timeout,
+            health_check_interval=30,
+            retry_on_timeout=False,
+        )
         self._ttl = ttl_seconds
         self._prefix = "openflag:flag:"
+        
+        # Circuit breaker state
+        self._failures = 0
+        self._open_until = 0.0
+    
+    def _record_failure(self, error: Exception) -> None:
+        """Count a Redis failure, opening the circuit past the threshold"""
+        logger.warning("Redis error: %s", error)
+        self._failures += 1
+        if self._failures >= CIRCUIT_BREAKER_THRESHOLD:
+            self._failures = 0
+            self._open_until = time.monotonic() + CIRCUIT_BREAKER_COOLDOWN
+            logger.warning(
+                "Redis unavailable (%s); bypassing cache for %.0fs",
+                error, CIRCUIT_BREAKER_COOLDOWN
+            )
     
-    def get(self, key: str) -> Optional[Flag]:
-        """Get flag from Redis cache"""
+    @_fail_open()
+    async def get(self, key: str) -> Union[Flag, object, None]:
+        """Get flag from Redis cache, or MISS for a known missing key"""
         cache_key = f"{self._prefix}{key}"
-        data = self._redis.get(cache_key)
-        
-        if not data:
-            return None
+        data = await self._redis.get(cache_key)
+        return self._decode(data)
+    
+    @_fail_open(dict)
+    async def get_many(self, keys: List[str]) -> Dict[str, Flag]:
+        """Get cached flags for the given keys in a single MGET"""
+        if not keys:
+            return {}
         
-        try:
-            flag_dict = json.loads(data)
-            return Flag(**flag_dict)
-        except (json.JSONDecodeError, Exception):
-            return None
+        values = await self._redis.mget([f"{self._prefix}{key}" for key in keys])
+        found = {}
+        for key, data in zip(keys, values):
+            flag = self._decode(data)
+            if flag and flag is not MISS:
+                found[key] = flag
+        return found
     
-    def set(self, key: str, flag: Flag) -> None:
+    @_fail_open()
+    async def set(self, key: str, flag: Flag) -> None:
         """Store flag in Redis with TTL"""
         cache_key = f"{self._prefix}{key}"
-        data = flag.model_dump_json()
-        self._redis.setex(cache_key, self._ttl, data)
+        data = self._encode(flag)
+        await self._redis.setex(cache_key, self._ttl, data)
+    
+    @_fail_open()
+    async def set_miss(self, key: str) -> None:
+        """Remember briefly that no flag exists for this key"""
+        cache_key = f"{self._prefix}{key}"
+        await self._redis.setex(cache_key, min(self._ttl, NEGATIVE_CACHE_TTL), MISS_PAYLOAD)
+    
+    @_fail_open()
+    async def set_many(self, flags: List[Flag]) -> None:
+        """Store several flags in Redis with TTL in a single round-trip"""
+        if not flags:
+            return
+        
+        pipe = self._redis.pipeline(transaction=False)
+        for flag in flags:
+            pipe.setex(f"{self._prefix}{flag.key}", self._ttl, self._encode(flag))
+        await pipe.execute()
     
-    def delete(self, key: str) -> None:
+    @_always_try
+    async def delete(self, key: str) -> None:
         """Remove flag from Redis"""
         cache_key = f"{self._prefix}{key}"
-        self._redis.delete(cache_key)
+        await self._redis.delete(cache_key)
     
-    def clear(self) -> None:
+    @_always_try
+    async def clear(self) -> None:
         """Clear all cached flags"""
-        keys = self._redis.keys(f"{self._prefix}*")
-        if keys:
-            self._redis.delete(*keys)
+        # SCAN instead of KEYS so Redis is never blocked walking the whole
+        # keyspace; UNLINK frees memory in the background
+        pipe = self._redis.pipeline(transaction=False)
+        batch = []
+        keys = self._redis.scan_iter(match=f"{self._prefix}*", count=SCAN_BATCH_SIZE)
+        async for cache_key in keys:
+            batch.append(cache_key)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                pipe.unlink(*batch)
+                batch.clear()
+        if batch:
+            pipe.unlink(*batch)
+        await pipe.execute()
+    
+    async def close(self) -> None:
+        """Close the Redis connection pool"""
+        await self._redis.aclose()
+    
+    @staticmethod
+    def _encode(flag: Flag) -> str:
+        """Serialize a flag as a versioned cache payload"""
+        # pydantic-core's encoder beats orjson.dumps(flag.model_dump()) here,
+        # since the latter has to build an intermediate dict first
+        return f"{CACHE_FORMAT_VERSION}:{flag.model_dump_json()}"
+    
+    @staticmethod
+    def _decode(data: Optional[str]) -> Union[Flag, object, None]:
+        """Deserialize a cached payload, treating corrupt or stale entries as misses"""
+        if not data:
+            return None
+        if data == MISS_PAYLOAD:
+            return MISS
+        
+        version, _, payload = data.partition(":")
+        if version != CACHE_FORMAT_VERSION:
+            return None
+        
+        try:
+            fields = orjson.loads(payload)
+            fields["type"] = FlagType(fields["type"])
+            fields["created_at"] = _parse_datetime(fields["created_at"])
+            fields["updated_at"] = _parse_datetime(fields["updated_at"])
+        except (ValueError, KeyError, TypeError):
+            return None
+        
+        # Skip validation: we wrote this payload ourselves
+        return Flag.model_construct(**fields)
 
 
 # Initialize cache based on configuration
@@ -93,13 +325,27 @@ def create_cache():
     """Factory function to create appropriate cache instance"""
     if REDIS_AVAILABLE and settings.redis_url:
         try:
-            return RedisCache(settings.redis_url, settings.cache_ttl)
+            return RedisCache(
+                settings.redis_url,
+                settings.cache_ttl,
+                settings.redis_max_connections,
+                settings.redis_socket_timeout,
+                settings.redis_connect_timeout,
+            )
         except Exception as e:
             print(f"Failed to connect to Redis: {e}. Falling back to in-memory cache.")
-            return InMemoryCache(settings.cache_ttl)
+            return InMemoryCache(settings.cache_ttl, settings.cache_max_size)
     else:
-        return InMemoryCache(settings.cache_ttl)
+        return InMemoryCache(settings.cache_ttl, settings.cache_max_size)
 
 
 # Global cache instance
 flag_cache = create_cache()
+
+CacheBackend = Union[InMemoryCache, RedisCache]
+
+
+async def get_flag_cache() -> CacheBackend:
+    """Get the flag cache for dependency injection"""
+    # Async so FastAPI resolves it inline rather than in the threadpool
+    return flag_cache
@@ -1,5 +1,6 @@
 """Application configuration management."""
 import os
+from functools import lru_cache
 from typing import Optional
 from pydantic_settings import BaseSettings
 
@@ -15,13 +16,19 @@ class Settings(BaseSettings):
     
     # Redis
     redis_url: Optional[str] = os.getenv("REDIS_URL")
+    redis_max_connections: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+    redis_socket_timeout: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.05"))
+    redis_connect_timeout: float = float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.1"))
     
     # Cache
     cache_ttl: int = int(os.getenv("CACHE_TTL", "30"))
+    cache_max_size: int = int(os.getenv("CACHE_MAX_SIZE", "10000"))
     
     # Application
     environment: str = os.getenv("ENVIRONMENT", "development")
     log_level: str = os.getenv("LOG_LEVEL", "info")
+    # Set by the test suite; skips startup work the tests do themselves
+    testing: bool = os.getenv("TESTING", "0") == "1"
     
     # CORS
     cors_origins: list[str] = [
@@ -35,5 +42,11 @@ class Settings(BaseSettings):
         case_sensitive = False
 
 
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Get the process-wide settings, parsing the environment only once"""
+    return Settings()
+
+
 # Global settings instance
-settings = Settings()
+settings = get_settings()
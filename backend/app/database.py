@@ -1,4 +1,7 @@
 """Database configuration and session management"""
+import logging
+
+from sqlalchemy import event
 from sqlmodel import SQLModel, create_engine, Session
 from typing import Generator
 from .config import settings
@@ -11,13 +14,39 @@ if settings.database_url.startswith("sqlite"):
 
 engine = create_engine(
     settings.database_url,
-    echo=(settings.environment == "development"),  # Log SQL queries in development
+    echo=False,  # SQL logging goes through the sqlalchemy.engine logger below
     connect_args=connect_args,
     pool_pre_ping=True,  # Verify connections before using
     pool_size=5,  # Connection pool size
     max_overflow=10,  # Max overflow connections
 )
 
+# SQLAlchemy logs every statement at INFO, so only let that through when
+# debugging; otherwise statements are never formatted at all
+logging.getLogger("sqlalchemy.engine").setLevel(
+    logging.INFO if settings.log_level.lower() == "debug" else logging.WARNING
+)
+
+# Tuned for a read-heavy workload: WAL lets readers run alongside the
+# writer, and NORMAL sync only fsyncs at checkpoints under WAL
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-64000",  # 64 MB page cache
+    "mmap_size=268435456",  # 256 MB memory-mapped I/O
+    "foreign_keys=ON",
+)
+
+if settings.database_url.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Apply SQLITE_PRAGMAS to every new SQLite connection"""
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {pragma}")
+        cursor.close()
+
 
 def create_db_and_tables():
     """Create all database tables"""
@@ -1,14 +1,17 @@
 """FastAPI application main entry point"""
 from contextlib import asynccontextmanager
-from typing import Dict
+from typing import Dict, List
 import logging
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from sqlmodel import Session, select
 
-from app.database import create_db_and_tables
+from app.database import create_db_and_tables, engine
+from app.models import Flag
 from app.routers import flags
 from app.config import settings
+from app.cache import CacheBackend, flag_cache
 
 # Configure logging
 logging.basicConfig(
@@ -18,6 +21,18 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _load_enabled_flags(session: Session) -> List[Flag]:
+    """Load every enabled flag for cache warmup"""
+    return list(session.exec(select(Flag).where(Flag.enabled == True)).all())  # noqa: E712
+
+
+async def warm_cache(session: Session, cache: CacheBackend) -> int:
+    """Cache every enabled flag, returning how many were cached"""
+    enabled_flags = _load_enabled_flags(session)
+    await cache.set_many(enabled_flags)
+    return len(enabled_flags)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events"""
@@ -26,12 +41,22 @@ async def lifespan(app: FastAPI):
     logger.info(f"Database: {settings.database_url.split('@')[-1] if '@' in settings.database_url else settings.database_url}")
     logger.info(f"Cache: {'Redis' if settings.redis_url else 'In-Memory'}")
     
-    create_db_and_tables()
-    logger.info("Database tables created/verified")
+    if settings.testing:
+        # Tests create their own schema and expect an empty cache
+        logger.info("Testing mode: skipping table creation and cache warmup")
+    else:
+        create_db_and_tables()
+        logger.info("Database tables created/verified")
+        
+        # Warm the cache so early requests don't all miss
+        with Session(engine) as session:
+            warmed = await warm_cache(session, flag_cache)
+        logger.info(f"Cache warmed with {warmed} enabled flags")
     
     yield
     
-    # Shutdown: cleanup if needed
+    # Shutdown: release cache connections
+    await flag_cache.close()
     logger.info("Shutting down OpenFlag")
 
 
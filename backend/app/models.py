@@ -1,11 +1,16 @@
 """Database models for OpenFlag"""
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 from enum import Enum
 
 from sqlmodel import Field, SQLModel
 
 
+def utcnow() -> datetime:
+    """Current time as a timezone-aware UTC datetime"""
+    return datetime.now(timezone.utc)
+
+
 class FlagType(str, Enum):
     """Flag value types"""
     BOOLEAN = "boolean"
@@ -25,8 +30,9 @@ class Flag(SQLModel, table=True):
     type: FlagType = Field(default=FlagType.BOOLEAN)
     value: str = Field(default="false")  # Store all values as strings
     enabled: bool = Field(default=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utcnow)
+    # Refreshed by SQLAlchemy whenever the row is updated
+    updated_at: datetime = Field(default_factory=utcnow, sa_column_kwargs={"onupdate": utcnow})
 
 
 class FlagCreate(SQLModel):
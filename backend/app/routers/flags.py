@@ -1,28 +1,37 @@
 """Feature flags CRUD API endpoints"""
-from typing import List, Optional
-from datetime import datetime
+from typing import Dict, List, Optional
+import json
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam
 from sqlmodel import Session, select
 
 from app.database import get_session
-from app.models import Flag, FlagCreate, FlagUpdate, FlagResponse
-from app.cache import flag_cache
+from app.models import Flag, FlagCreate, FlagUpdate, FlagResponse, FlagType
+from app.cache import MISS, CacheBackend, CacheUnavailableError, get_flag_cache
 
 
 router = APIRouter()
 
+# Most flags one request may fetch; each becomes a bound parameter in an
+# IN query, so this stays well under SQLite's 999 variable limit on older builds
+MAX_PAGE_SIZE = 500
+MAX_BULK_KEYS = 500
+
+# Built once and reused for every lookup by key
+_SELECT_BY_KEY = select(Flag).where(Flag.key == bindparam("key"))
+
 
 @router.post("", response_model=FlagResponse, status_code=status.HTTP_201_CREATED)
 async def create_flag(
     flag_data: FlagCreate,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    cache: CacheBackend = Depends(get_flag_cache)
 ) -> Flag:
     """Create a new feature flag"""
     # Check if key already exists
-    existing = session.exec(
-        select(Flag).where(Flag.key == flag_data.key)
-    ).first()
+    existing = _query_flag_by_key(session, flag_data.key)
     
     if existing:
         raise HTTPException(
@@ -40,7 +49,7 @@ async def create_flag(
     session.refresh(new_flag)
     
     # Update cache
-    flag_cache.set(new_flag.key, new_flag)
+    await cache.set(new_flag.key, new_flag)
     
     return new_flag
 
@@ -48,64 +57,84 @@ async def create_flag(
 @router.get("", response_model=List[FlagResponse])
 async def list_flags(
     skip: int = 0,
-    limit: int = 100,
-    session: Session = Depends(get_session)
-) -> List[Flag]:
-    """List all feature flags with pagination"""
-    flags = session.exec(
-        select(Flag).offset(skip).limit(limit)
-    ).all()
-    return list(flags)
+    limit: int = Query(100, ge=0, le=MAX_PAGE_SIZE),
+    session: Session = Depends(get_session),
+    cache: CacheBackend = Depends(get_flag_cache)
+) -> Response:
+    """List all feature flags with pagination (with caching)"""
+    # Resolve the page as keys only, then serve what we can from cache
+    keys = await run_in_threadpool(_query_page_keys, session, skip, limit)
+    if not keys:
+        return _json_response("[]")
+    
+    flags = await _load_flags(session, cache, keys)
+    items = ",".join(_flag_json(flags[key]) for key in keys if key in flags)
+    return _json_response(f"[{items}]")
+
+
+@router.post("/bulk", response_model=Dict[str, FlagResponse])
+async def get_flags_by_keys(
+    keys: List[str] = Body(..., max_length=MAX_BULK_KEYS),
+    session: Session = Depends(get_session),
+    cache: CacheBackend = Depends(get_flag_cache)
+) -> Dict[str, Flag]:
+    """Get several flags by key in one call (with caching)"""
+    # Deduplicate while keeping the requested order
+    keys = list(dict.fromkeys(keys))
+    flags = await _load_flags(session, cache, keys)
+    
+    # Unknown keys are simply left out of the result
+    return {key: flags[key] for key in keys if key in flags}
 
 
 @router.get("/{flag_id}", response_model=FlagResponse)
 async def get_flag(
     flag_id: int,
     session: Session = Depends(get_session)
-) -> Flag:
+) -> Response:
     """Get a single flag by ID"""
-    flag = session.get(Flag, flag_id)
+    flag = await run_in_threadpool(session.get, Flag, flag_id)
     if not flag:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Flag with id {flag_id} not found"
         )
-    return flag
+    return _json_response(_flag_json(flag))
 
 
 @router.get("/key/{key}", response_model=FlagResponse)
 async def get_flag_by_key(
     key: str,
-    session: Session = Depends(get_session)
-) -> Flag:
+    session: Session = Depends(get_session),
+    cache: CacheBackend = Depends(get_flag_cache)
+) -> Response:
     """Get a single flag by key (with caching)"""
-    # Check cache first
-    cached_flag = flag_cache.get(key)
-    if cached_flag:
-        return cached_flag
+    # Check cache first; MISS means the key was recently found not to exist
+    flag = await cache.get(key)
     
-    # Query database
-    flag = session.exec(
-        select(Flag).where(Flag.key == key)
-    ).first()
+    if flag is None:
+        # Query database and cache the result, including a 404
+        flag = await run_in_threadpool(_query_flag_by_key, session, key)
+        if flag:
+            await cache.set(key, flag)
+        else:
+            await cache.set_miss(key)
     
-    if not flag:
+    if flag is None or flag is MISS:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Flag with key '{key}' not found"
         )
     
-    # Update cache
-    flag_cache.set(key, flag)
-    
-    return flag
+    return _json_response(_flag_json(flag))
 
 
 @router.put("/{flag_id}", response_model=FlagResponse)
 async def update_flag(
     flag_id: int,
     flag_update: FlagUpdate,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    cache: CacheBackend = Depends(get_flag_cache)
 ) -> Flag:
     """Update an existing flag"""
     flag = session.get(Flag, flag_id)
@@ -124,24 +153,24 @@ async def update_flag(
         new_value = update_data.get("value", flag.value)
         _validate_flag_value(new_type, new_value)
     
+    # Invalidate cache before committing, so a failure never hides a saved change
+    await _invalidate(cache, flag.key)
+    
     for key, value in update_data.items():
         setattr(flag, key, value)
     
-    flag.updated_at = datetime.utcnow()
     session.add(flag)
     session.commit()
     session.refresh(flag)
     
-    # Invalidate cache
-    flag_cache.delete(flag.key)
-    
     return flag
 
 
 @router.delete("/{flag_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_flag(
     flag_id: int,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    cache: CacheBackend = Depends(get_flag_cache)
 ) -> None:
     """Delete a flag"""
     flag = session.get(Flag, flag_id)
@@ -152,34 +181,115 @@ async def delete_flag(
         )
     
     # Invalidate cache
-    flag_cache.delete(flag.key)
+    await _invalidate(cache, flag.key)
     
     session.delete(flag)
     session.commit()
 
 
+async def _invalidate(cache: CacheBackend, key: str) -> None:
+    """Drop a flag from cache ahead of a write, refusing the write if that fails"""
+    try:
+        await cache.delete(key)
+    except CacheUnavailableError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Flag cache is unavailable; the change was not saved"
+        )
+
+
+# Read endpoints serialize flags themselves and return a Response, which
+# FastAPI passes through without re-validating it against response_model;
+# the response_model is still declared for the OpenAPI schema
+_RESPONSE_FIELDS = tuple(FlagResponse.model_fields)
+
+
+def _flag_json(flag: Flag) -> str:
+    """Serialize a flag with the FlagResponse schema, skipping validation"""
+    fields = {name: getattr(flag, name) for name in _RESPONSE_FIELDS}
+    return FlagResponse.model_construct(**fields).model_dump_json()
+
+
+def _json_response(content: str) -> Response:
+    """Wrap pre-serialized JSON in a response"""
+    return Response(content=content, media_type="application/json")
+
+
+async def _load_flags(session: Session, cache: CacheBackend, keys: List[str]) -> Dict[str, Flag]:
+    """Get flags by key from cache, loading all misses in a single query"""
+    flags = await cache.get_many(keys)
+    
+    missing = [key for key in keys if key not in flags]
+    if missing:
+        loaded = await run_in_threadpool(_query_flags_by_keys, session, missing)
+        await cache.set_many(loaded)
+        flags.update((flag.key, flag) for flag in loaded)
+    
+    return flags
+
+
+# Blocking read queries, run via run_in_threadpool so the event loop stays free
+def _query_page_keys(session: Session, skip: int, limit: int) -> List[str]:
+    """Get the flag keys for one page of results, in creation order"""
+    # Without an explicit order SQLite answers a keys-only query from the
+    # key index and pages through flags alphabetically
+    statement = select(Flag.key).order_by(Flag.id).offset(skip).limit(limit)
+    return list(session.exec(statement).all())
+
+
+def _query_flags_by_keys(session: Session, keys: List[str]) -> List[Flag]:
+    """Get all flags matching the given keys in a single query"""
+    return list(session.exec(select(Flag).where(Flag.key.in_(keys))).all())
+
+
+def _query_flag_by_key(session: Session, key: str) -> Optional[Flag]:
+    """Get a flag by key"""
+    return session.exec(_SELECT_BY_KEY, params={"key": key}).first()
+
+
+def _validate_boolean(value: str) -> None:
+    """Validate a boolean flag value"""
+    if value not in _BOOLEAN_VALUES and value.lower() not in _BOOLEAN_VALUES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Boolean flags must have value 'true' or 'false'"
+        )
+
+
+def _validate_number(value: str) -> None:
+    """Validate a number flag value"""
+    try:
+        float(value)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Number flags must have a numeric value"
+        )
+
+
+def _validate_json(value: str) -> None:
+    """Validate a JSON flag value"""
+    try:
+        json.loads(value)
+    except json.JSONDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="JSON flags must have valid JSON value"
+        )
+
+
+# Common spellings first so most values match without lowercasing
+_BOOLEAN_VALUES = frozenset({"true", "True", "TRUE", "false", "False", "FALSE"})
+
+_VALIDATORS = {
+    FlagType.BOOLEAN: _validate_boolean,
+    FlagType.NUMBER: _validate_number,
+    FlagType.JSON: _validate_json,
+}
+
+
 def _validate_flag_value(flag_type: str, value: str) -> None:
     """Validate flag value based on type"""
-    if flag_type == "boolean":
-        if value.lower() not in ["true", "false"]:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Boolean flags must have value 'true' or 'false'"
-            )
-    elif flag_type == "number":
-        try:
-            float(value)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Number flags must have a numeric value"
-            )
-    elif flag_type == "json":
-        import json
-        try:
-            json.loads(value)
-        except json.JSONDecodeError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="JSON flags must have valid JSON value"
-            )
+    validator = _VALIDATORS.get(flag_type)
+    if validator:
+        validator(value)
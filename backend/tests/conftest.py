@@ -1,41 +1,134 @@
 """Test configuration and fixtures"""
+import os
+from functools import lru_cache
+from typing import Callable, List
+
 import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
-from fastapi.testclient import TestClient
 
-from app.main import app
-from app.database import get_session
-from app.cache import flag_cache
+# Must be set before the app loads its settings
+os.environ["TESTING"] = "1"
+
+from app.main import app  # noqa: E402
+from app.database import get_session  # noqa: E402
+from app.cache import flag_cache  # noqa: E402
+from app.models import Flag, FlagType  # noqa: E402
+
 
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(items):
+    """Keep each class of database tests together on one xdist worker"""
+    # Runs before xdist reads the groups. Every worker has its own database,
+    # so this only keeps related tests together; classes still run in parallel
+    for item in items:
+        if item.get_closest_marker("db") and item.cls is not None:
+            item.add_marker(pytest.mark.xdist_group(name=item.cls.__name__))
 
-@pytest.fixture(name="session")
-def session_fixture():
-    """Create a fresh database session for each test"""
+
+@lru_cache(maxsize=None)
+def _engine_for(worker: str) -> Engine:
+    """Create the in-memory test database for one xdist worker, once per process"""
     # Use in-memory SQLite for tests
     engine = create_engine(
         "sqlite:///:memory:",
         connect_args={"check_same_thread": False},
         poolclass=StaticPool,
     )
+    
+    # pysqlite's own transaction handling breaks SAVEPOINT, so turn it off
+    # and let SQLAlchemy emit BEGIN itself
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, "begin")
+    def begin_transaction(connection):
+        connection.exec_driver_sql("BEGIN")
+    
     SQLModel.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture(name="engine", scope="session")
+def engine_fixture() -> Engine:
+    """Get this worker's test database engine"""
+    # Not set when running without xdist
+    return _engine_for(os.environ.get("PYTEST_XDIST_WORKER", "master"))
+
+
+@pytest.fixture(name="db_session")
+def db_session_fixture(engine):
+    """Create a database session whose changes are rolled back after each test"""
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        
+        # Commits made by the app only release a SAVEPOINT inside the
+        # outer transaction, which is rolled back when the test ends
+        with Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+            yield session
+        
+        transaction.rollback()
+
+
+@pytest.fixture(name="flag_factory")
+def flag_factory_fixture(db_session: Session) -> Callable[..., Flag]:
+    """Provide a helper that seeds a single flag directly through the ORM"""
+    def make_flag(
+        key: str, flag_type: FlagType = FlagType.BOOLEAN, value: str = "true"
+    ) -> Flag:
+        flag = Flag(key=key, name=key.replace("_", " ").title(), type=flag_type, value=value)
+        db_session.add(flag)
+        db_session.flush()
+        return flag
+    
+    return make_flag
+
+
+@pytest.fixture(name="flag")
+def flag_fixture(flag_factory: Callable[..., Flag]) -> Flag:
+    """Seed one boolean flag for tests that only need an existing flag"""
+    return flag_factory("seed")
+
+
+@pytest.fixture(name="flags_factory")
+def flags_factory_fixture(db_session: Session) -> Callable[[int], List[str]]:
+    """Provide a helper that inserts several flags with a single statement"""
+    def make_flags(count: int) -> List[str]:
+        keys = [f"flag_{i}" for i in range(count)]
+        db_session.bulk_insert_mappings(Flag, [
+            Flag(key=key, name=f"Flag {i}", value="true").model_dump(exclude={"id"})
+            for i, key in enumerate(keys)
+        ])
+        db_session.commit()
+        return keys
     
-    with Session(engine) as session:
-        yield session
+    return make_flags
+
+
+@pytest.fixture(name="transport", scope="session")
+def transport_fixture():
+    """Create a single ASGI transport shared by every test"""
+    # ASGITransport never runs the app's lifespan, and TESTING would skip its
+    # startup work against the real database if it did
+    return ASGITransport(app=app)
 
 
 @pytest.fixture(name="client")
-def client_fixture(session: Session):
-    """Create a test client with overridden database session"""
+async def client_fixture(transport: ASGITransport, db_session: Session):
+    """Create an async test client with overridden database session"""
     def get_session_override():
-        return session
+        return db_session
     
     app.dependency_overrides[get_session] = get_session_override
     
     # Clear cache before each test
-    flag_cache.clear()
+    await flag_cache.clear()
     
-    client = TestClient(app)
-    yield client
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
     
     app.dependency_overrides.clear()
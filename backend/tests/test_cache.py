@@ -0,0 +1,265 @@
+"""Tests for the flag cache backends"""
+from datetime import datetime
+from typing import List
+
+import pytest
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from sqlmodel import Session
+
+from app.cache import (
+    CACHE_FORMAT_VERSION,
+    CIRCUIT_BREAKER_THRESHOLD,
+    MISS,
+    CacheUnavailableError,
+    MISS_PAYLOAD,
+    SCAN_BATCH_SIZE,
+    InMemoryCache,
+    RedisCache,
+)
+from app.main import warm_cache
+from app.models import Flag, FlagType
+
+
+def make_flag(key: str) -> Flag:
+    """Build an unsaved flag for cache tests"""
+    return Flag(key=key, name=key.title(), type="boolean", value="true")
+
+
+class TestInMemoryCache:
+    """Tests for InMemoryCache expiry and eviction"""
+    
+    async def test_get_returns_cached_flag(self):
+        """Test that a stored flag is returned until it expires"""
+        cache = InMemoryCache(ttl_seconds=30)
+        await cache.set("alpha", make_flag("alpha"))
+        
+        flag = await cache.get("alpha")
+        
+        assert flag is not None
+        assert flag.key == "alpha"
+    
+    async def test_expired_flag_is_dropped(self):
+        """Test that an expired entry is treated as a miss"""
+        cache = InMemoryCache(ttl_seconds=-1)
+        await cache.set("alpha", make_flag("alpha"))
+        
+        assert await cache.get("alpha") is None
+    
+    async def test_missing_key_is_remembered(self):
+        """Test that set_miss makes get return MISS without affecting get_many"""
+        cache = InMemoryCache(ttl_seconds=30)
+        await cache.set_miss("ghost")
+        
+        assert await cache.get("ghost") is MISS
+        assert await cache.get_many(["ghost"]) == {}
+    
+    async def test_least_recently_used_flag_is_evicted(self):
+        """Test that overflowing max_size evicts the least recently used flag"""
+        cache = InMemoryCache(ttl_seconds=30, max_size=2, shards=1)
+        await cache.set("alpha", make_flag("alpha"))
+        await cache.set("beta", make_flag("beta"))
+        
+        # Touch alpha so beta becomes the eviction candidate
+        await cache.get("alpha")
+        await cache.set("gamma", make_flag("gamma"))
+        
+        assert await cache.get("beta") is None
+        assert set(await cache.get_many(["alpha", "beta", "gamma"])) == {"alpha", "gamma"}
+
+
+class TestRedisPayloadFormat:
+    """Tests for the versioned payloads RedisCache stores"""
+    
+    def test_round_trip_restores_field_types(self):
+        """Test that a decoded flag has the same values and types as the original"""
+        flag = Flag(id=7, key="config", name="Config", type=FlagType.JSON, value='{"a": 1}')
+        
+        decoded = RedisCache._decode(RedisCache._encode(flag))
+        
+        assert decoded.model_dump() == flag.model_dump()
+        # Catches new fields that come back as raw JSON types
+        for name in Flag.model_fields:
+            assert type(getattr(decoded, name)) is type(getattr(flag, name)), name
+        assert isinstance(decoded.type, FlagType)
+        assert isinstance(decoded.created_at, datetime)
+        assert isinstance(decoded.updated_at, datetime)
+    
+    def test_payload_is_version_prefixed(self):
+        """Test that encoded payloads start with the cache format version"""
+        payload = RedisCache._encode(make_flag("alpha"))
+        
+        assert payload.startswith(f"{CACHE_FORMAT_VERSION}:")
+    
+    @pytest.mark.parametrize("payload", [
+        make_flag("alpha").model_dump_json(),
+        f"0:{make_flag('alpha').model_dump_json()}",
+    ], ids=["unprefixed", "other-version"])
+    def test_other_versions_are_ignored(self, payload: str):
+        """Test that unprefixed legacy and other-version payloads decode as misses"""
+        assert RedisCache._decode(payload) is None
+    
+    @pytest.mark.parametrize("payload", [
+        f"{CACHE_FORMAT_VERSION}:{{not json",
+        f"{CACHE_FORMAT_VERSION}:{{}}",
+        f'{CACHE_FORMAT_VERSION}:{{"type": "colour", "created_at": "x", "updated_at": "x"}}',
+    ], ids=["invalid-json", "missing-fields", "bad-values"])
+    def test_corrupt_payload_is_ignored(self, payload: str):
+        """Test that unparseable payloads decode as misses instead of raising"""
+        assert RedisCache._decode(payload) is None
+    
+    def test_miss_payload_decodes_to_miss(self):
+        """Test that the stored not-found marker decodes to MISS"""
+        assert RedisCache._decode(MISS_PAYLOAD) is MISS
+
+
+class StalledRedis:
+    """Stand-in Redis client whose commands always time out"""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    async def get(self, key):
+        self.calls += 1
+        raise RedisTimeoutError("Timeout reading from socket")
+    
+    async def delete(self, key):
+        self.calls += 1
+        raise RedisTimeoutError("Timeout reading from socket")
+
+
+class TestRedisCacheFailover:
+    """Tests for RedisCache behaviour when Redis is unavailable"""
+    
+    async def test_timeout_is_treated_as_miss(self):
+        """Test that a Redis timeout returns a miss instead of raising"""
+        cache = RedisCache("redis://localhost:6379")
+        cache._redis = StalledRedis()
+        
+        assert await cache.get("alpha") is None
+    
+    async def test_circuit_opens_after_repeated_failures(self):
+        """Test that Redis is skipped once the failure threshold is reached"""
+        cache = RedisCache("redis://localhost:6379")
+        stalled = StalledRedis()
+        cache._redis = stalled
+        
+        for _ in range(CIRCUIT_BREAKER_THRESHOLD + 3):
+            assert await cache.get("alpha") is None
+        
+        assert stalled.calls == CIRCUIT_BREAKER_THRESHOLD
+    
+    async def test_delete_is_attempted_while_circuit_is_open(self):
+        """Test that invalidation still reaches Redis and reports failure with the circuit open"""
+        cache = RedisCache("redis://localhost:6379")
+        stalled = StalledRedis()
+        cache._redis = stalled
+        
+        for _ in range(CIRCUIT_BREAKER_THRESHOLD):
+            await cache.get("alpha")
+        
+        with pytest.raises(CacheUnavailableError):
+            await cache.delete("alpha")
+        assert stalled.calls == CIRCUIT_BREAKER_THRESHOLD + 1
+
+
+class RecordingPipeline:
+    """Stand-in Redis pipeline that records queued commands"""
+    
+    def __init__(self, redis: "RecordingRedis"):
+        self._redis = redis
+    
+    def setex(self, key, ttl, value):
+        self._redis.commands.append(("setex", (key, ttl, value)))
+    
+    def unlink(self, *keys):
+        self._redis.commands.append(("unlink", keys))
+    
+    async def execute(self):
+        self._redis.executes += 1
+        return []
+
+
+class RecordingRedis:
+    """Stand-in Redis client that records pipelined commands"""
+    
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+        self.commands = []
+        self.executes = 0
+    
+    def pipeline(self, transaction=True):
+        assert transaction is False
+        return RecordingPipeline(self)
+    
+    async def scan_iter(self, match=None, count=None):
+        for key in self.keys:
+            yield key
+
+
+class TestRedisCachePipelining:
+    """Tests for RedisCache commands batched into one pipeline"""
+    
+    @pytest.mark.parametrize("count,batch_sizes", [
+        (0, []),
+        (1, [1]),
+        (SCAN_BATCH_SIZE, [SCAN_BATCH_SIZE]),
+        (SCAN_BATCH_SIZE * 2 + 1, [SCAN_BATCH_SIZE, SCAN_BATCH_SIZE, 1]),
+    ], ids=["empty", "single", "one-full-batch", "two-batches-and-rest"])
+    async def test_clear_unlinks_in_batches(self, count: int, batch_sizes: List[int]):
+        """Test that clear unlinks keys in SCAN_BATCH_SIZE chunks and sends them together"""
+        keys = [f"openflag:flag:flag_{i}" for i in range(count)]
+        redis = RecordingRedis(keys)
+        cache = RedisCache("redis://localhost:6379")
+        cache._redis = redis
+        
+        await cache.clear()
+        
+        assert [name for name, _ in redis.commands] == ["unlink"] * len(batch_sizes)
+        assert [len(args) for _, args in redis.commands] == batch_sizes
+        assert [key for _, args in redis.commands for key in args] == keys
+        assert redis.executes == 1
+    
+    async def test_set_many_sends_one_pipeline(self):
+        """Test that set_many queues a SETEX per flag and sends them in one round-trip"""
+        redis = RecordingRedis()
+        cache = RedisCache("redis://localhost:6379", ttl_seconds=30)
+        cache._redis = redis
+        flags = [make_flag("alpha"), make_flag("beta")]
+        
+        await cache.set_many(flags)
+        
+        assert redis.commands == [
+            ("setex", (f"openflag:flag:{flag.key}", 30, RedisCache._encode(flag)))
+            for flag in flags
+        ]
+        assert redis.executes == 1
+    
+    async def test_set_many_with_no_flags_skips_redis(self):
+        """Test that set_many with an empty list sends nothing"""
+        redis = RecordingRedis()
+        cache = RedisCache("redis://localhost:6379")
+        cache._redis = redis
+        
+        await cache.set_many([])
+        
+        assert redis.commands == []
+        assert redis.executes == 0
+
+
+@pytest.mark.db
+class TestCacheWarmup:
+    """Tests for the startup cache warmup"""
+    
+    async def test_only_enabled_flags_are_cached(self, db_session: Session):
+        """Test that warmup loads enabled flags from the database and skips disabled ones"""
+        for key, enabled in [("on_a", True), ("off", False), ("on_b", True)]:
+            flag = make_flag(key)
+            flag.enabled = enabled
+            db_session.add(flag)
+        db_session.flush()
+        cache = InMemoryCache(ttl_seconds=30)
+        
+        warmed = await warm_cache(db_session, cache)
+        
+        assert warmed == 2
+        assert set(await cache.get_many(["on_a", "off", "on_b"])) == {"on_a", "on_b"}
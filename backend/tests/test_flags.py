@@ -1,394 +1,348 @@
 """Comprehensive tests for feature flags CRUD API"""
+from unittest.mock import MagicMock
+
 import pytest
-from fastapi.testclient import TestClient
+from httpx import AsyncClient
+from redis.exceptions import ConnectionError as RedisConnectionError
+from sqlmodel import Session
+
+from app.cache import RedisCache, flag_cache, get_flag_cache
+from app.main import app
+from app.models import Flag, FlagType
+from app.routers.flags import MAX_BULK_KEYS, MAX_PAGE_SIZE
+
+pytestmark = pytest.mark.db
+
+# Shared request payload fragments
+BOOL_TRUE = {"type": "boolean", "value": "true"}
+BOOL_FALSE = {"type": "boolean", "value": "false"}
 
 
 class TestCreateFlag:
     """Tests for creating feature flags"""
     
-    def test_create_boolean_flag(self, client: TestClient):
-        """Test creating a boolean flag"""
-        response = client.post(
+    @pytest.mark.parametrize("key,name,flag_type,value", [
+        ("new_feature", "New Feature", "boolean", "true"),
+        ("api_url", "API URL", "string", "https://api.example.com"),
+        ("max_retries", "Max Retries", "number", "3"),
+        ("config", "Configuration", "json", '{"timeout": 30, "retries": 3}'),
+    ])
+    async def test_create_flag(
+        self, client: AsyncClient, key: str, name: str, flag_type: str, value: str
+    ):
+        """Test creating a flag of each type"""
+        response = await client.post(
             "/api/flags",
             json={
-                "key": "new_feature",
-                "name": "New Feature",
-                "description": "Enable new feature",
-                "type": "boolean",
-                "value": "true"
+                "key": key,
+                "name": name,
+                "description": f"{name} flag",
+                "type": flag_type,
+                "value": value
             }
         )
         
         assert response.status_code == 201
         data = response.json()
-        assert data["key"] == "new_feature"
-        assert data["name"] == "New Feature"
-        assert data["type"] == "boolean"
-        assert data["value"] == "true"
+        assert data["key"] == key
+        assert data["name"] == name
+        assert data["type"] == flag_type
+        assert data["value"] == value
         assert "id" in data
         assert "created_at" in data
     
-    def test_create_string_flag(self, client: TestClient):
-        """Test creating a string flag"""
-        response = client.post(
-            "/api/flags",
-            json={
-                "key": "api_url",
-                "name": "API URL",
-                "type": "string",
-                "value": "https://api.example.com"
-            }
-        )
-        
-        assert response.status_code == 201
-        data = response.json()
-        assert data["type"] == "string"
-        assert data["value"] == "https://api.example.com"
-    
-    def test_create_number_flag(self, client: TestClient):
-        """Test creating a number flag"""
-        response = client.post(
-            "/api/flags",
-            json={
-                "key": "max_retries",
-                "name": "Max Retries",
-                "type": "number",
-                "value": "3"
-            }
-        )
-        
-        assert response.status_code == 201
-        data = response.json()
-        assert data["type"] == "number"
-        assert data["value"] == "3"
-    
-    def test_create_json_flag(self, client: TestClient):
-        """Test creating a JSON flag"""
-        response = client.post(
-            "/api/flags",
-            json={
-                "key": "config",
-                "name": "Configuration",
-                "type": "json",
-                "value": '{"timeout": 30, "retries": 3}'
-            }
-        )
-        
-        assert response.status_code == 201
-        data = response.json()
-        assert data["type"] == "json"
-    
-    def test_create_duplicate_key_fails(self, client: TestClient):
+    async def test_create_duplicate_key_fails(self, client: AsyncClient, flag_factory):
         """Test that creating a flag with duplicate key fails"""
-        # Create first flag
-        client.post(
-            "/api/flags",
-            json={
-                "key": "duplicate",
-                "name": "First Flag",
-                "type": "boolean",
-                "value": "true"
-            }
-        )
-        
-        # Try to create second with same key
-        response = client.post(
-            "/api/flags",
-            json={
-                "key": "duplicate",
-                "name": "Second Flag",
-                "type": "boolean",
-                "value": "false"
-            }
-        )
-        
-        assert response.status_code == 400
-        assert "already exists" in response.json()["detail"]
-    
-    def test_invalid_boolean_value_fails(self, client: TestClient):
-        """Test that invalid boolean value is rejected"""
-        response = client.post(
-            "/api/flags",
-            json={
-                "key": "bad_bool",
-                "name": "Bad Boolean",
-                "type": "boolean",
-                "value": "yes"
-            }
-        )
+        flag_factory("duplicate")
         
-        assert response.status_code == 400
-        assert "true" in response.json()["detail"].lower()
-    
-    def test_invalid_number_value_fails(self, client: TestClient):
-        """Test that invalid number value is rejected"""
-        response = client.post(
+        # Try to create a second flag with the same key
+        response = await client.post(
             "/api/flags",
-            json={
-                "key": "bad_number",
-                "name": "Bad Number",
-                "type": "number",
-                "value": "not-a-number"
-            }
+            json={"key": "duplicate", "name": "Second Flag", **BOOL_FALSE}
         )
         
         assert response.status_code == 400
-        assert "numeric" in response.json()["detail"].lower()
+        data = response.json()
+        assert "already exists" in data["detail"]
     
-    def test_invalid_json_value_fails(self, client: TestClient):
-        """Test that invalid JSON value is rejected"""
-        response = client.post(
+    async def test_invalid_value_fails(self, client: AsyncClient):
+        """Test that an invalid value is rejected by the API"""
+        # Each validation rule is covered in test_validation.py
+        response = await client.post(
             "/api/flags",
-            json={
-                "key": "bad_json",
-                "name": "Bad JSON",
-                "type": "json",
-                "value": "{invalid json"
-            }
+            json={"key": "bad_number", "name": "Bad Number", "type": "number", "value": "many"}
         )
         
         assert response.status_code == 400
-        assert "json" in response.json()["detail"].lower()
+        data = response.json()
+        assert "numeric" in data["detail"].lower()
 
 
 class TestListFlags:
     """Tests for listing feature flags"""
     
-    def test_list_empty_flags(self, client: TestClient):
+    async def test_list_empty_flags(self, client: AsyncClient):
         """Test listing when no flags exist"""
-        response = client.get("/api/flags")
+        response = await client.get("/api/flags")
         
         assert response.status_code == 200
         assert response.json() == []
     
-    def test_list_multiple_flags(self, client: TestClient):
+    async def test_list_multiple_flags(self, client: AsyncClient, flags_factory):
         """Test listing multiple flags"""
-        # Create test flags
-        for i in range(3):
-            client.post(
-                "/api/flags",
-                json={
-                    "key": f"flag_{i}",
-                    "name": f"Flag {i}",
-                    "type": "boolean",
-                    "value": "true"
-                }
-            )
+        flags_factory(3)
         
-        response = client.get("/api/flags")
+        response = await client.get("/api/flags")
         
         assert response.status_code == 200
         data = response.json()
         assert len(data) == 3
         assert all("id" in flag for flag in data)
     
-    def test_list_flags_pagination(self, client: TestClient):
-        """Test pagination of flag list"""
-        # Create 5 flags
-        for i in range(5):
-            client.post(
+    async def test_list_flags_in_creation_order(self, client: AsyncClient):
+        """Test that flags are listed in the order they were created"""
+        for key in ["zeta", "alpha", "mu"]:
+            await client.post(
                 "/api/flags",
-                json={
-                    "key": f"flag_{i}",
-                    "name": f"Flag {i}",
-                    "type": "boolean",
-                    "value": "true"
-                }
+                json={"key": key, "name": key.title(), **BOOL_TRUE}
             )
         
+        response = await client.get("/api/flags")
+        
+        assert response.status_code == 200
+        assert [flag["key"] for flag in response.json()] == ["zeta", "alpha", "mu"]
+    
+    async def test_list_flags_pagination(self, client: AsyncClient, flags_factory):
+        """Test pagination of flag list"""
+        keys = flags_factory(5)
+        
         # Get first 2
-        response = client.get("/api/flags?skip=0&limit=2")
+        response = await client.get("/api/flags?skip=0&limit=2")
         assert response.status_code == 200
-        assert len(response.json()) == 2
+        assert [flag["key"] for flag in response.json()] == keys[:2]
         
         # Get next 2
-        response = client.get("/api/flags?skip=2&limit=2")
+        response = await client.get("/api/flags?skip=2&limit=2")
+        assert response.status_code == 200
+        assert [flag["key"] for flag in response.json()] == keys[2:4]
+    
+    async def test_list_flags_mixes_cached_and_uncached(self, client: AsyncClient):
+        """Test listing returns fresh data when only some flags are cached"""
+        flag_ids = []
+        for i in range(3):
+            create_response = await client.post(
+                "/api/flags",
+                json={"key": f"flag_{i}", "name": f"Flag {i}", **BOOL_TRUE}
+            )
+            flag_ids.append(create_response.json()["id"])
+        
+        # Updating invalidates the cached copy of the middle flag
+        await client.put(f"/api/flags/{flag_ids[1]}", json={"name": "Renamed"})
+        
+        response = await client.get("/api/flags")
+        
         assert response.status_code == 200
-        assert len(response.json()) == 2
+        data = response.json()
+        assert [flag["key"] for flag in data] == ["flag_0", "flag_1", "flag_2"]
+        assert data[1]["name"] == "Renamed"
+    
+    async def test_list_flags_limit_is_capped(self, client: AsyncClient):
+        """Test that a page larger than MAX_PAGE_SIZE is rejected"""
+        response = await client.get(f"/api/flags?limit={MAX_PAGE_SIZE + 1}")
+        
+        assert response.status_code == 422
 
 
 class TestGetFlag:
     """Tests for getting individual flags"""
     
-    def test_get_flag_by_id(self, client: TestClient):
+    async def test_get_flag_by_id(self, client: AsyncClient, flag: Flag):
         """Test getting a flag by ID"""
-        # Create a flag
-        create_response = client.post(
-            "/api/flags",
-            json={
-                "key": "test_flag",
-                "name": "Test Flag",
-                "type": "boolean",
-                "value": "true"
-            }
-        )
-        flag_id = create_response.json()["id"]
-        
-        # Get by ID
-        response = client.get(f"/api/flags/{flag_id}")
+        response = await client.get(f"/api/flags/{flag.id}")
         
         assert response.status_code == 200
         data = response.json()
-        assert data["id"] == flag_id
-        assert data["key"] == "test_flag"
+        assert data["id"] == flag.id
+        assert data["key"] == "seed"
     
-    def test_get_flag_by_key(self, client: TestClient):
+    async def test_get_flag_by_key(self, client: AsyncClient, flag: Flag):
         """Test getting a flag by key"""
-        # Create a flag
-        client.post(
-            "/api/flags",
-            json={
-                "key": "test_key",
-                "name": "Test Flag",
-                "type": "boolean",
-                "value": "true"
-            }
-        )
-        
-        # Get by key
-        response = client.get("/api/flags/key/test_key")
+        response = await client.get("/api/flags/key/seed")
         
         assert response.status_code == 200
         data = response.json()
-        assert data["key"] == "test_key"
+        assert data["key"] == "seed"
     
-    def test_get_nonexistent_flag_by_id(self, client: TestClient):
+    async def test_get_nonexistent_flag_by_id(self, client: AsyncClient):
         """Test getting a non-existent flag by ID returns 404"""
-        response = client.get("/api/flags/9999")
+        response = await client.get("/api/flags/9999")
         
         assert response.status_code == 404
-        assert "not found" in response.json()["detail"]
+        data = response.json()
+        assert "not found" in data["detail"]
     
-    def test_get_nonexistent_flag_by_key(self, client: TestClient):
+    async def test_get_nonexistent_flag_by_key(self, client: AsyncClient):
         """Test getting a non-existent flag by key returns 404"""
-        response = client.get("/api/flags/key/nonexistent")
+        response = await client.get("/api/flags/key/nonexistent")
         
         assert response.status_code == 404
-        assert "not found" in response.json()["detail"]
+        data = response.json()
+        assert "not found" in data["detail"]
     
-    def test_get_flag_by_key_uses_cache(self, client: TestClient):
-        """Test that getting by key uses cache on second request"""
-        # Create a flag
-        client.post(
+    async def test_get_flag_by_key_after_cached_not_found(self, client: AsyncClient):
+        """Test that creating a flag replaces its cached not-found result"""
+        # First lookup caches the 404
+        response = await client.get("/api/flags/key/late_flag")
+        assert response.status_code == 404
+        
+        await client.post(
             "/api/flags",
-            json={
-                "key": "cached_flag",
-                "name": "Cached Flag",
-                "type": "boolean",
-                "value": "true"
-            }
+            json={"key": "late_flag", "name": "Late Flag", **BOOL_TRUE}
         )
         
-        # First request (should cache)
-        response1 = client.get("/api/flags/key/cached_flag")
-        assert response1.status_code == 200
+        response = await client.get("/api/flags/key/late_flag")
+        assert response.status_code == 200
+        assert response.json()["key"] == "late_flag"
+    
+    async def test_get_flag_by_key_uses_cache(self, client: AsyncClient, flag: Flag):
+        """Test that getting by key uses cache on second request"""
+        spy = MagicMock(wraps=flag_cache)
+        app.dependency_overrides[get_flag_cache] = lambda: spy
+        
+        # First request misses and caches the flag
+        response = await client.get("/api/flags/key/seed")
+        assert response.status_code == 200
+        assert spy.get.call_count == 1
+        assert spy.set.call_count == 1
         
-        # Second request (should use cache)
-        response2 = client.get("/api/flags/key/cached_flag")
-        assert response2.status_code == 200
-        assert response1.json() == response2.json()
+        # Second request is served from cache
+        response = await client.get("/api/flags/key/seed")
+        assert response.status_code == 200
+        assert spy.get.call_count == 2
+        assert spy.set.call_count == 1
 
 
-class TestUpdateFlag:
-    """Tests for updating flags"""
+class TestBulkGetFlags:
+    """Tests for getting several flags by key at once"""
     
-    def test_update_flag_name(self, client: TestClient):
-        """Test updating a flag's name"""
-        # Create a flag
-        create_response = client.post(
+    async def test_bulk_get_flags(self, client: AsyncClient):
+        """Test that bulk lookup returns found flags keyed by flag key"""
+        for key in ["alpha", "beta"]:
+            await client.post(
+                "/api/flags",
+                json={"key": key, "name": key.title(), **BOOL_TRUE}
+            )
+        
+        response = await client.post("/api/flags/bulk", json=["beta", "alpha", "missing"])
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert list(data) == ["beta", "alpha"]
+        assert data["alpha"]["name"] == "Alpha"
+    
+    async def test_bulk_get_loads_uncached_flags(self, client: AsyncClient):
+        """Test that bulk lookup falls back to the database on cache misses"""
+        create_response = await client.post(
             "/api/flags",
-            json={
-                "key": "update_test",
-                "name": "Original Name",
-                "type": "boolean",
-                "value": "true"
-            }
+            json={"key": "uncached", "name": "Uncached", **BOOL_TRUE}
         )
         flag_id = create_response.json()["id"]
         
-        # Update name
-        response = client.put(
-            f"/api/flags/{flag_id}",
+        # Updating drops the flag from cache
+        await client.put(f"/api/flags/{flag_id}", json={"value": "false"})
+        
+        response = await client.post("/api/flags/bulk", json=["uncached"])
+        
+        assert response.status_code == 200
+        assert response.json()["uncached"]["value"] == "false"
+    
+    async def test_bulk_get_accepts_max_keys(self, client: AsyncClient, flag: Flag):
+        """Test that bulk lookup accepts exactly MAX_BULK_KEYS keys"""
+        keys = ["seed"] + [f"missing_{i}" for i in range(MAX_BULK_KEYS - 1)]
+        
+        response = await client.post("/api/flags/bulk", json=keys)
+        
+        assert response.status_code == 200
+        assert list(response.json()) == ["seed"]
+    
+    async def test_bulk_get_rejects_too_many_keys(self, client: AsyncClient):
+        """Test that bulk lookup rejects more than MAX_BULK_KEYS keys"""
+        keys = [f"flag_{i}" for i in range(MAX_BULK_KEYS + 1)]
+        
+        response = await client.post("/api/flags/bulk", json=keys)
+        
+        assert response.status_code == 422
+
+
+class TestUpdateFlag:
+    """Tests for updating flags"""
+    
+    async def test_update_flag_name(self, client: AsyncClient, flag: Flag):
+        """Test updating a flag's name"""
+        response = await client.put(
+            f"/api/flags/{flag.id}",
             json={"name": "Updated Name"}
         )
         
         assert response.status_code == 200
         data = response.json()
         assert data["name"] == "Updated Name"
-        assert data["key"] == "update_test"  # Should not change
+        assert data["key"] == "seed"  # Should not change
     
-    def test_update_flag_value(self, client: TestClient):
+    async def test_update_flag_value(self, client: AsyncClient, flag: Flag):
         """Test updating a flag's value"""
-        # Create a flag
-        create_response = client.post(
-            "/api/flags",
-            json={
-                "key": "toggle",
-                "name": "Toggle",
-                "type": "boolean",
-                "value": "false"
-            }
+        response = await client.put(
+            f"/api/flags/{flag.id}",
+            json={"value": "false"}
         )
-        flag_id = create_response.json()["id"]
         
-        # Update value
-        response = client.put(
-            f"/api/flags/{flag_id}",
-            json={"value": "true"}
+        assert response.status_code == 200
+        assert response.json()["value"] == "false"
+    
+    async def test_update_flag_enabled_status(self, client: AsyncClient, flag: Flag):
+        """Test updating a flag's enabled status"""
+        response = await client.put(
+            f"/api/flags/{flag.id}",
+            json={"enabled": False}
         )
         
         assert response.status_code == 200
-        assert response.json()["value"] == "true"
+        assert response.json()["enabled"] is False
     
-    def test_update_flag_enabled_status(self, client: TestClient):
-        """Test updating a flag's enabled status"""
-        # Create a flag
-        create_response = client.post(
+    async def test_update_flag_refreshes_updated_at(self, client: AsyncClient):
+        """Test that updating a flag moves its updated_at timestamp forward"""
+        create_response = await client.post(
             "/api/flags",
-            json={
-                "key": "disable_test",
-                "name": "Disable Test",
-                "type": "boolean",
-                "value": "true"
-            }
+            json={"key": "timestamp_test", "name": "Timestamp Test", **BOOL_TRUE}
         )
-        flag_id = create_response.json()["id"]
+        created = create_response.json()
         
-        # Disable flag
-        response = client.put(
-            f"/api/flags/{flag_id}",
-            json={"enabled": False}
+        response = await client.put(
+            f"/api/flags/{created['id']}",
+            json={"value": "false"}
         )
         
         assert response.status_code == 200
-        assert response.json()["enabled"] is False
+        data = response.json()
+        assert data["created_at"] == created["created_at"]
+        assert data["updated_at"] > created["updated_at"]
     
-    def test_update_nonexistent_flag(self, client: TestClient):
+    async def test_update_nonexistent_flag(self, client: AsyncClient):
         """Test updating a non-existent flag returns 404"""
-        response = client.put(
+        response = await client.put(
             "/api/flags/9999",
             json={"name": "New Name"}
         )
         
         assert response.status_code == 404
     
-    def test_update_with_invalid_value_fails(self, client: TestClient):
+    async def test_update_with_invalid_value_fails(self, client: AsyncClient, flag_factory):
         """Test that updating with invalid value fails"""
-        # Create a number flag
-        create_response = client.post(
-            "/api/flags",
-            json={
-                "key": "number_flag",
-                "name": "Number Flag",
-                "type": "number",
-                "value": "42"
-            }
-        )
-        flag_id = create_response.json()["id"]
+        flag = flag_factory("number_flag", FlagType.NUMBER, "42")
         
         # Try to update with invalid number
-        response = client.put(
-            f"/api/flags/{flag_id}",
+        response = await client.put(
+            f"/api/flags/{flag.id}",
             json={"value": "not-a-number"}
         )
         
@@ -398,55 +352,70 @@ class TestUpdateFlag:
 class TestDeleteFlag:
     """Tests for deleting flags"""
     
-    def test_delete_flag(self, client: TestClient):
+    async def test_delete_flag(self, client: AsyncClient, flag: Flag):
         """Test deleting a flag"""
-        # Create a flag
-        create_response = client.post(
-            "/api/flags",
-            json={
-                "key": "delete_me",
-                "name": "Delete Me",
-                "type": "boolean",
-                "value": "true"
-            }
-        )
-        flag_id = create_response.json()["id"]
+        # Read the id up front; the app's commit expires the deleted row
+        flag_id = flag.id
         
-        # Delete it
-        response = client.delete(f"/api/flags/{flag_id}")
+        response = await client.delete(f"/api/flags/{flag_id}")
         
         assert response.status_code == 204
         
         # Verify it's gone
-        get_response = client.get(f"/api/flags/{flag_id}")
+        get_response = await client.get(f"/api/flags/{flag_id}")
         assert get_response.status_code == 404
     
-    def test_delete_nonexistent_flag(self, client: TestClient):
+    async def test_delete_nonexistent_flag(self, client: AsyncClient):
         """Test deleting a non-existent flag returns 404"""
-        response = client.delete("/api/flags/9999")
+        response = await client.delete("/api/flags/9999")
         
         assert response.status_code == 404
     
-    def test_delete_flag_invalidates_cache(self, client: TestClient):
+    async def test_delete_flag_invalidates_cache(self, client: AsyncClient, flag: Flag):
         """Test that deleting a flag removes it from cache"""
-        # Create and cache a flag
-        create_response = client.post(
-            "/api/flags",
-            json={
-                "key": "cache_delete",
-                "name": "Cache Delete",
-                "type": "boolean",
-                "value": "true"
-            }
-        )
-        flag_id = create_response.json()["id"]
-        
         # Cache it by getting by key
-        client.get("/api/flags/key/cache_delete")
+        await client.get("/api/flags/key/seed")
         
         # Delete it
-        client.delete(f"/api/flags/{flag_id}")
+        await client.delete(f"/api/flags/{flag.id}")
         
         # Try to get by key (should not use cache)
-        response = client.get("/api/flags/key/cache_delete")
+        response = await client.get("/api/flags/key/seed")
         assert response.status_code == 404
+
+
+class UnreachableRedis:
+    """Stand-in Redis client that refuses every command"""
+    
+    def __getattr__(self, name):
+        async def command(*args, **kwargs):
+            raise RedisConnectionError("Connection refused")
+        return command
+
+
+class TestWritesWithRedisDown:
+    """Tests that writes are refused, not half-applied, when invalidation fails"""
+    
+    @pytest.fixture(autouse=True)
+    def redis_down(self):
+        """Route the app to a Redis cache that cannot be reached"""
+        cache = RedisCache("redis://localhost:6379")
+        cache._redis = UnreachableRedis()
+        app.dependency_overrides[get_flag_cache] = lambda: cache
+    
+    async def test_update_is_refused(self, client: AsyncClient, flag: Flag, db_session: Session):
+        """Test that an update returns 503 and leaves the stored flag unchanged"""
+        response = await client.put(f"/api/flags/{flag.id}", json={"value": "false"})
+        
+        assert response.status_code == 503
+        db_session.refresh(flag)
+        assert flag.value == "true"
+    
+    async def test_delete_is_refused(self, client: AsyncClient, flag: Flag, db_session: Session):
+        """Test that a delete returns 503 and keeps the stored flag"""
+        flag_id = flag.id
+        
+        response = await client.delete(f"/api/flags/{flag_id}")
+        
+        assert response.status_code == 503
+        assert db_session.get(Flag, flag_id) is not None
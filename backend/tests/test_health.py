@@ -1,10 +1,10 @@
 """Tests for health check endpoint"""
-from fastapi.testclient import TestClient
+from httpx import AsyncClient
 
 
-def test_health_check(client: TestClient):
+async def test_health_check(client: AsyncClient):
     """Test health check endpoint returns healthy status"""
-    response = client.get("/health")
+    response = await client.get("/health")
     
     assert response.status_code == 200
     data = response.json()
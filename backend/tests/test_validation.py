@@ -0,0 +1,38 @@
+"""Unit tests for flag value validation"""
+import pytest
+from fastapi import HTTPException
+
+from app.models import FlagType
+from app.routers.flags import _validate_flag_value
+
+pytestmark = pytest.mark.unit
+
+
+class TestValidateFlagValue:
+    """Tests for _validate_flag_value, called directly without the app"""
+    
+    @pytest.mark.parametrize("flag_type,value", [
+        (FlagType.BOOLEAN, "true"),
+        (FlagType.BOOLEAN, "FALSE"),
+        (FlagType.BOOLEAN, "tRuE"),
+        (FlagType.STRING, "anything goes"),
+        (FlagType.NUMBER, "3"),
+        (FlagType.NUMBER, "-1.5e3"),
+        (FlagType.JSON, '{"timeout": 30, "retries": 3}'),
+    ])
+    def test_valid_value_passes(self, flag_type: FlagType, value: str):
+        """Test that a value matching the flag type is accepted"""
+        _validate_flag_value(flag_type, value)
+    
+    @pytest.mark.parametrize("flag_type,value,expected_detail", [
+        (FlagType.BOOLEAN, "yes", "true"),
+        (FlagType.NUMBER, "not-a-number", "numeric"),
+        (FlagType.JSON, "{invalid json", "json"),
+    ])
+    def test_invalid_value_fails(self, flag_type: FlagType, value: str, expected_detail: str):
+        """Test that a value not matching the flag type is rejected with a 400"""
+        with pytest.raises(HTTPException) as exc_info:
+            _validate_flag_value(flag_type, value)
+        
+        assert exc_info.value.status_code == 400
+        assert expected_detail in exc_info.value.detail.lower()
@@ -31,6 +31,12 @@ case "$1" in
     PYTHONPATH="$PROJECT_ROOT/backend" pytest backend/ -v
     ;;
 
+  test-fast)
+    echo -e "${BLUE}Running backend tests, last failures first...${NC}"
+    source .venv/bin/activate
+    PYTHONPATH="$PROJECT_ROOT/backend" pytest backend/ --ff --maxfail=5
+    ;;
+
   dev)
     echo -e "${BLUE}Starting backend development server...${NC}"
     source .venv/bin/activate
@@ -56,7 +62,7 @@ case "$1" in
     echo -e "${BLUE}Cleaning up...${NC}"
     find . -type d -name "__pycache__" -exec rm -rf {} + 2>/dev/null || true
     find . -type f -name "*.pyc" -delete 2>/dev/null || true
-    rm -rf backend/.pytest_cache backend/openflag.db
+    rm -rf backend/.pytest_cache backend/openflag.db backend/openflag.db-wal backend/openflag.db-shm
     echo -e "${GREEN}✓ Cleaned${NC}"
     ;;
 
@@ -68,6 +74,7 @@ case "$1" in
     echo "Commands:"
     echo "  install   - Install backend dependencies"
     echo "  test      - Run backend tests"
+    echo "  test-fast - Run previously failing tests first, stop after 5 failures"
     echo "  dev       - Start backend development server"
     echo "  format    - Format Python code with black"
     echo "  lint      - Lint Python code with flake8"